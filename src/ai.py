@@ -1,54 +1,152 @@
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from pydantic import ValidationError
 from pydantic_ai import Agent
+from pydantic_ai.exceptions import UnexpectedModelBehavior
 import pydantic_core
 
-from disk_cache import DiskCache
+from cache_key import CacheKey, explain_miss
+from disk_cache import FINGERPRINT_SIDECAR, KEY_SIDECAR, DiskCache
+from fingerprint import fingerprint
 from logger import logger
+from profiler import profiler
 from models import (
     MapTemplate,
     ModelResponseUnion,
 )
+from router import Router, find_problems
 from templates import Templates
 from config import Config
 
+# Agents keyed by (model, retries), they are expensive to build.
+AgentPool = Dict[Tuple[str, int], Agent]
+
+
+def new_agent(model: str, retries: int) -> Agent:
+    return Agent(
+        model,
+        output_type=ModelResponseUnion,
+        retries=retries,
+    )
+
 
 class AI:
-    def __init__(self, cache: DiskCache, templates: Templates, config: Config) -> None:
+    def __init__(
+        self,
+        cache: DiskCache,
+        templates: Templates,
+        config: Config,
+        agents: Optional[AgentPool] = None,
+    ) -> None:
         self.config = config
-        self.agent = Agent(
-            self.config.llm_model,
-            output_type=ModelResponseUnion,
-            retries=self.config.llm_retries,
-        )
+        self.agents: AgentPool = agents if agents is not None else {}
+        self.router = Router(config)
         self.cache = cache
         self.templates = templates
 
+    def agent_for(self, model: str) -> Agent:
+        key = (model, self.config.llm_retries)
+        if key not in self.agents:
+            self.agents[key] = new_agent(model, self.config.llm_retries)
+        return self.agents[key]
+
     def start(self) -> MapTemplate:
         prompt = self.templates.get_initial_prompt()
         logger.debug(f"Sending prompt: {prompt}")
         return self.__ask(prompt)
 
     def __ask(self, prompt: str) -> MapTemplate:
-        cached_response = self.cache.get(prompt)
+        models = self.router.models()
+        keys = {model: CacheKey.new(prompt, model, self.config) for model in models}
+        with profiler.span("cache get"):
+            cached_response = self.__lookup(prompt, keys)
         if cached_response:
-            logger.debug(f"Using cached response: {cached_response}")
-            result = MapTemplate.model_validate(
-                pydantic_core.from_json(cached_response)
-            )
-            logger.debug(
-                f"Using cached response: {result.model_dump_json(indent=2, by_alias=True, exclude_none=True)}"
-            )
+            with profiler.span("validation", source="cache"):
+                result = MapTemplate.model_validate(
+                    pydantic_core.from_json(cached_response)
+                )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"Using cached response: {result.model_dump_json(indent=2, by_alias=True, exclude_none=True)}"
+                )
             return result
 
-        agent_result = self.agent.run_sync(prompt)
-        result = MapTemplate.model_validate(agent_result.output)
-        logger.debug(
-            f"AI initially responded with: {result.model_dump_json(by_alias=True, exclude_none=True)}, usage: {agent_result.usage()}"
-        )
-        self.cache.upsert(
-            prompt,
+        result, model = self.__run(prompt, models)
+        with profiler.span("cache upsert"):
+            self.__store(keys[model], result)
+        logger.debug("Saved to cache")
+        return result
+
+    def __lookup(self, prompt: str, keys: Dict[str, CacheKey]) -> Optional[str]:
+        # Later models are the stronger ones, prefer their answers.
+        for model, key in reversed(keys.items()):
+            cached_response = self.cache.get_hash(key.digest())
+            if cached_response:
+                logger.debug(f"Cache hit {key.digest()} for {model}")
+                return cached_response
+
+        if self.config.cache_legacy_fallback:
+            # Legacy entries do not record their model, so they are served as they
+            # are and never re-keyed.
+            cached_response = self.cache.get(prompt)
+            if cached_response:
+                logger.warning(
+                    f"Using unverified legacy cache entry {self.cache.hash(prompt)}, the model that produced it is unknown"
+                )
+                return cached_response
+
+        if logger.isEnabledFor(logging.DEBUG):
+            # Reads every key sidecar, so only worth it when debugging.
+            cached = (
+                (hash_key, CacheKey.from_json(value))
+                for hash_key, value in self.cache.iter_sidecar(KEY_SIDECAR)
+            )
+            logger.debug(f"Cache miss: {explain_miss(keys.values(), cached)}")
+        return None
+
+    def __store(self, key: CacheKey, result: MapTemplate):
+        hash_key = key.digest()
+        fp = fingerprint(result)
+        self.cache.put(
+            hash_key,
             pydantic_core.to_json(result, by_alias=True, exclude_none=True).decode(
                 "utf-8"
             ),
         )
-        logger.debug("Saved to cache")
-        return result
+        self.cache.put_sidecar(hash_key, KEY_SIDECAR, key.to_json())
+        if fp is not None:
+            self.cache.put_sidecar(hash_key, FINGERPRINT_SIDECAR, fp)
+
+    def __run(self, prompt: str, models: List[str]) -> Tuple[MapTemplate, str]:
+        logger.debug(f"Routing {self.router.estimate} to {models}")
+        for attempt, model in enumerate(models, start=1):
+            can_escalate = attempt < len(models)
+            started = time.perf_counter()
+            try:
+                with profiler.span("agent run", model=model):
+                    agent_result = self.agent_for(model).run_sync(prompt)
+                with profiler.span("validation", source="agent"):
+                    result = MapTemplate.model_validate(agent_result.output)
+            except (UnexpectedModelBehavior, ValidationError) as e:
+                self.router.record(model, attempt, started, [str(e)])
+                if not can_escalate:
+                    raise
+                logger.warning(f"{model} failed, escalating: {e}")
+                continue
+
+            problems = find_problems(result, self.config)
+            self.router.record(model, attempt, started, problems, agent_result.usage())
+            if problems and can_escalate:
+                logger.warning(
+                    f"{model} output failed validation, escalating: {problems}"
+                )
+                continue
+            if problems:
+                logger.warning(f"{model} output failed validation: {problems}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"{model} responded with: {result.model_dump_json(by_alias=True, exclude_none=True)}, usage: {agent_result.usage()}"
+                )
+            return result, model
+        raise RuntimeError("No model to send the prompt to")
@@ -0,0 +1,158 @@
+import hashlib
+import io
+import json
+import re
+import tarfile
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from disk_cache import SIDECARS, DiskCache
+from file import atomic_writer
+from logger import logger
+
+BUNDLE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+OBJECTS_DIR = "objects"
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+@dataclass
+class ImportStats:
+    imported: int = 0
+    skipped: int = 0
+    corrupt: List[str] = field(default_factory=list)
+
+
+def content_hash(value: bytes) -> str:
+    return hashlib.sha256(value).hexdigest()
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _entry_objects(
+    cache: DiskCache, sidecars: Dict[str, List[str]]
+) -> Iterator[Tuple[str, bytes, Dict[str, bytes]]]:
+    """Yields every entry as (hash, value, {sidecar name: sidecar value})."""
+    for hash_key, value in cache.entries():
+        objects: Dict[str, bytes] = {}
+        for name in sidecars.get(hash_key, []):
+            if name not in SIDECARS:
+                continue
+            sidecar = cache.get_sidecar(hash_key, name)
+            if sidecar is not None:
+                objects[name] = sidecar.encode("utf-8")
+        yield hash_key, value.encode("utf-8"), objects
+
+
+def export_cache(cache: DiskCache, bundle_path: str) -> int:
+    """
+    Writes every cache entry into a gzipped tar: the manifest comes first, followed
+    by the values (and sidecars) stored once under their sha256, so the import can
+    stream it.
+    """
+    sidecars = cache.sidecars()
+    entries: List[Dict[str, Any]] = []
+    for hash_key, value, objects in _entry_objects(cache, sidecars):
+        entries.append(
+            {
+                "key": hash_key,
+                "object": content_hash(value),
+                "size": len(value),
+                "sidecars": {
+                    name: content_hash(data) for name, data in objects.items()
+                },
+            }
+        )
+    manifest = {"version": BUNDLE_VERSION, "entries": entries}
+
+    with atomic_writer(bundle_path, binary=True) as f:
+        with tarfile.open(fileobj=f, mode="w|gz") as tar:
+            _add_bytes(
+                tar, MANIFEST_NAME, json.dumps(manifest, indent=2).encode("utf-8")
+            )
+            written: Set[str] = set()
+            for _, value, objects in _entry_objects(cache, sidecars):
+                for data in (value, *objects.values()):
+                    object_hash = content_hash(data)
+                    if object_hash in written:
+                        continue
+                    written.add(object_hash)
+                    _add_bytes(tar, f"{OBJECTS_DIR}/{object_hash}", data)
+    logger.info(f"Exported {len(entries)} cache entries to {bundle_path}")
+    return len(entries)
+
+
+def import_cache(cache: DiskCache, bundle_path: str) -> ImportStats:
+    """Merges a bundle into the cache, keeping entries that are already present."""
+    stats = ImportStats()
+    with tarfile.open(bundle_path, mode="r|gz") as tar:
+        member = tar.next()
+        if member is None or member.name != MANIFEST_NAME:
+            raise ValueError(f"{bundle_path} does not start with a {MANIFEST_NAME}")
+        manifest = json.load(tar.extractfile(member))  # type: ignore[arg-type]
+        if manifest.get("version") != BUNDLE_VERSION:
+            raise ValueError(f"Unsupported bundle version {manifest.get('version')}")
+
+        # Object hash -> (entry key, sidecar name or None for the value itself).
+        wanted: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+        for entry in manifest["entries"]:
+            key, object_hash = entry["key"], entry["object"]
+            sidecars = entry.get("sidecars", {})
+            if (
+                not _HASH_RE.match(key)
+                or not _HASH_RE.match(object_hash)
+                or not all(name in SIDECARS for name in sidecars)
+                or not all(_HASH_RE.match(h) for h in sidecars.values())
+            ):
+                logger.warning(f"Skipping malformed manifest entry {entry}")
+                stats.corrupt.append(key)
+            elif cache.contains(key):
+                stats.skipped += 1
+            else:
+                wanted.setdefault(object_hash, []).append((key, None))
+                for name, sidecar_hash in sidecars.items():
+                    wanted.setdefault(sidecar_hash, []).append((key, name))
+
+        # Sidecars are small, they are written once their entry made it in.
+        pending_sidecars: Dict[str, List[Tuple[str, str]]] = {}
+        for member in tar:
+            if not member.isfile():
+                # Left in wanted, so its entries are reported as missing.
+                continue
+            object_hash = member.name.removeprefix(f"{OBJECTS_DIR}/")
+            targets = wanted.pop(object_hash, None)
+            if targets is None:
+                continue
+            data = tar.extractfile(member).read()  # type: ignore[union-attr]
+            if content_hash(data) != object_hash:
+                logger.warning(f"Hash mismatch for {object_hash}, skipping {targets}")
+                stats.corrupt.extend(key for key, name in targets if name is None)
+                continue
+            value = data.decode("utf-8")
+            for key, name in targets:
+                if name is None:
+                    cache.put(key, value)
+                    stats.imported += 1
+                else:
+                    pending_sidecars.setdefault(key, []).append((name, value))
+
+    for object_hash, targets in wanted.items():
+        logger.warning(
+            f"Object {object_hash} is missing from the bundle, skipping {targets}"
+        )
+        stats.corrupt.extend(key for key, name in targets if name is None)
+    for key, sidecars in pending_sidecars.items():
+        if key in stats.corrupt:
+            continue
+        for name, value in sidecars:
+            cache.put_sidecar(key, name, value)
+    logger.info(
+        f"Imported {stats.imported} cache entries, skipped {stats.skipped} present, {len(stats.corrupt)} corrupt"
+    )
+    return stats
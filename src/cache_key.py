@@ -0,0 +1,81 @@
+import hashlib
+import json
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple
+
+from config import Config
+from models import MapTemplate
+
+# Bump when the way the key is derived changes.
+KEY_VERSION = 1
+
+
+def _sha256(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapses runs of whitespace and drops blank lines, which carry no meaning."""
+    lines = (" ".join(line.split()) for line in prompt.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+@lru_cache(maxsize=None)
+def schema_hash() -> str:
+    schema = MapTemplate.model_json_schema(by_alias=True)
+    return _sha256(json.dumps(schema, sort_keys=True))[:16]
+
+
+def generation_settings(config: Config) -> Dict[str, Any]:
+    # The seed is usually rendered into the prompt, but custom prompts may omit it.
+    return {"seed": config.llm_seed}
+
+
+@dataclass(frozen=True)
+class CacheKey:
+    prompt: str
+    model: str
+    schema: str
+    settings: str
+
+    @staticmethod
+    def new(prompt: str, model: str, config: Config) -> "CacheKey":
+        return CacheKey(
+            prompt=_sha256(normalize_prompt(prompt)),
+            model=model,
+            schema=schema_hash(),
+            settings=json.dumps(generation_settings(config), sort_keys=True),
+        )
+
+    def digest(self) -> str:
+        return _sha256(json.dumps([KEY_VERSION, asdict(self)]))
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), indent=2)
+
+    @staticmethod
+    def from_json(value: str) -> "CacheKey":
+        return CacheKey(**json.loads(value))
+
+
+def explain_miss(
+    keys: Iterable[CacheKey], cached: Iterable[Tuple[str, CacheKey]]
+) -> str:
+    """Compares the looked up keys with the cached ones that share the prompt."""
+    keys = list(keys)
+    prompt = keys[0].prompt
+    same_prompt: List[CacheKey] = [key for _, key in cached if key.prompt == prompt]
+    if not same_prompt:
+        return "no entry for this prompt"
+    models = {key.model for key in keys}
+    same_model = [key for key in same_prompt if key.model in models]
+    if not same_model:
+        other = sorted({key.model for key in same_prompt})
+        return f"prompt is only cached for other models: {other}"
+    schema = keys[0].schema
+    same_schema = [key for key in same_model if key.schema == schema]
+    if not same_schema:
+        return "the MapTemplate schema changed since the prompt was cached"
+    settings = sorted({key.settings for key in same_schema})
+    return f"generation settings differ, cached with {settings}, looking up {keys[0].settings}"
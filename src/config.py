@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import Optional
 import yaml
 from pydantic import BaseModel, Field
@@ -6,6 +7,37 @@ from file import os_expand
 from models import MapSize
 
 
+class DuplicatePolicy(str, Enum):
+    ALLOW = "allow"
+    # Do not save templates structurally identical to an already saved one.
+    REJECT = "reject"
+    # Save over the already saved template with the same structure.
+    MERGE = "merge"
+
+
+class RoutingConfig(BaseModel):
+    fast_model: str = Field(
+        description="The cheaper, faster model used for small and simple maps.",
+        default="anthropic:claude-3-5-haiku-latest",
+    )
+    strong_model: Optional[str] = Field(
+        description="The model used for large maps and when the fast model fails validation, defaults to llm_model.",
+        default=None,
+    )
+    max_fast_zones: int = Field(
+        description="Maps expected to have more zones than this go to the strong model.",
+        default=12,
+    )
+    max_fast_output_tokens: int = Field(
+        description="Maps expected to need more output tokens than this go to the strong model.",
+        default=6000,
+    )
+    log_path: str = Field(
+        description="JSON lines file that records every routing decision with its latency and outcome.",
+        default="$XDG_CACHE_HOME/aiomad/routing.jsonl",
+    )
+
+
 class Config(BaseModel):
     llm_model: str = Field(
         description="The LLM model to use to generate the output with (pydantic AI), requires the correct env var with the token.",
@@ -38,11 +70,25 @@ class Config(BaseModel):
         description="Overrides the template name generated by the LLM by default.",
         default=None,
     )
+    cache_legacy_fallback: bool = Field(
+        description="Also serve cache entries keyed by the raw prompt only (created before keys included the model). They are not re-keyed, and the model that produced them is unknown, so only enable this if llm_model has not changed since.",
+        default=False,
+    )
+    duplicates: DuplicatePolicy = Field(
+        description="What to do when the generated template has the same structure (zone graph, sizes, mines and treasure bands) as one already in save_path.",
+        default=DuplicatePolicy.ALLOW,
+    )
+    llm_routing: Optional[RoutingConfig] = Field(
+        description="Routes small maps to a faster model and escalates on invalid output, llm_model is used for everything when not set.",
+        default=None,
+    )
 
     def expand(self):
         self.save_path = os_expand(self.save_path)
         if self.prompt_template_overwrite is not None:
             self.prompt_template_overwrite = os_expand(self.prompt_template_overwrite)
+        if self.llm_routing is not None:
+            self.llm_routing.log_path = os_expand(self.llm_routing.log_path)
 
 
 def load(path: str) -> Config:
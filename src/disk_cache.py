@@ -1,7 +1,13 @@
 import os
 import hashlib
-from typing import Optional
-from file import ensure_dir_exists, os_expand
+from typing import Dict, Iterator, List, Optional, Tuple
+from file import ensure_dir_exists, os_expand, write_file_atomic
+
+
+CACHE_FILE_EXTENSION = ".txt"
+KEY_SIDECAR = "key"
+FINGERPRINT_SIDECAR = "fingerprint"
+SIDECARS = (KEY_SIDECAR, FINGERPRINT_SIDECAR)
 
 
 class DiskCache:
@@ -9,20 +15,65 @@ class DiskCache:
         self.cache_path = os_expand(cache_path)
         ensure_dir_exists(self.cache_path)
 
-    def upsert(self, key: str, value: str) -> None:
-        hash_key = self.hash(key)
-        file_path = os.path.join(self.cache_path, f"{hash_key}.txt")
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(value)
+    def put(self, hash_key: str, value: str) -> None:
+        write_file_atomic(self.path(hash_key), value)
+
+    def contains(self, hash_key: str) -> bool:
+        return os.path.exists(self.path(hash_key))
 
     def get(self, key: str) -> Optional[str]:
-        hash_key = self.hash(key)
-        file_path = os.path.join(self.cache_path, f"{hash_key}.txt")
+        return self.get_hash(self.hash(key))
+
+    def get_hash(self, hash_key: str) -> Optional[str]:
+        try:
+            with open(self.path(hash_key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def entries(self) -> Iterator[Tuple[str, str]]:
+        """Yields (hash, value) pairs, reading one entry at a time."""
+        for file in sorted(os.listdir(self.cache_path)):
+            if not file.endswith(CACHE_FILE_EXTENSION):
+                continue
+            with open(os.path.join(self.cache_path, file), "r", encoding="utf-8") as f:
+                yield file[: -len(CACHE_FILE_EXTENSION)], f.read()
+
+    def put_sidecar(self, hash_key: str, name: str, value: str) -> None:
+        if name not in SIDECARS:
+            raise ValueError(f"Unknown cache sidecar {name}")
+        write_file_atomic(self.path(hash_key, name), value)
+
+    def get_sidecar(self, hash_key: str, name: str) -> Optional[str]:
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
+            with open(self.path(hash_key, name), "r", encoding="utf-8") as f:
                 return f.read()
         except FileNotFoundError:
             return None
 
+    def sidecars(self) -> Dict[str, List[str]]:
+        """Sidecar names per entry hash."""
+        found: Dict[str, List[str]] = {}
+        for file in sorted(os.listdir(self.cache_path)):
+            hash_key, _, name = file.partition(".")
+            if hash_key and name and f".{name}" != CACHE_FILE_EXTENSION:
+                found.setdefault(hash_key, []).append(name)
+        return found
+
+    def iter_sidecar(self, name: str) -> Iterator[Tuple[str, str]]:
+        """Yields (hash, value) of every entry with the given sidecar."""
+        suffix = f".{name}"
+        for file in sorted(os.listdir(self.cache_path)):
+            if file.endswith(suffix):
+                with open(
+                    os.path.join(self.cache_path, file), "r", encoding="utf-8"
+                ) as f:
+                    yield file[: -len(suffix)], f.read()
+
+    def path(self, hash_key: str, sidecar: Optional[str] = None) -> str:
+        if sidecar is not None:
+            return os.path.join(self.cache_path, f"{hash_key}.{sidecar}")
+        return os.path.join(self.cache_path, f"{hash_key}{CACHE_FILE_EXTENSION}")
+
     def hash(self, prompt: str) -> str:
         return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
@@ -1,4 +1,8 @@
 import os
+import stat
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Any, Iterator
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -11,8 +15,37 @@ def ensure_dir_exists(path: str):
     os.makedirs(path, exist_ok=True)
 
 
-def write_file(path: str, content: str):
+def _file_mode(path: str) -> int:
+    """The mode of the file being replaced, or what a plain open() would create."""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+@contextmanager
+def atomic_writer(path: str, binary: bool = False) -> Iterator[IO[Any]]:
+    """Writes to a temporary file next to `path` and moves it in place on success."""
     path = os_expand(path)
-    ensure_dir_exists(os.path.dirname(path))
-    with open(path, "w+") as f:
+    directory = os.path.dirname(path)
+    ensure_dir_exists(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        mode, encoding = ("wb", None) if binary else ("w", "utf-8")
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+            f.flush()
+            # mkstemp creates 0600 files, which os.replace would keep.
+            os.fchmod(f.fileno(), _file_mode(path))
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_file_atomic(path: str, content: str):
+    with atomic_writer(path) as f:
         f.write(content)
@@ -0,0 +1,272 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from file import ensure_dir_exists, write_file_atomic
+from logger import logger
+from models import MapTemplate
+from template_loader import (
+    TEMPLATE_FILE_EXTENSION,
+    ZoneGraph,
+    iter_raw_templates,
+    read_template_file,
+)
+
+WL_ITERATIONS = 3
+# Treasure and guard values are compared in bands so that small tweaks still match.
+VALUE_BAND = 5000
+DENSITY_BAND = 5
+INDEX_FILE = ".fingerprints.jsonl"
+# Raised for what MapTemplate accepts but the compact zone graph cannot hold, e.g.
+# non-numeric zone ids or sizes and owners beyond the array ranges.
+FINGERPRINT_ERRORS = (KeyError, ValueError, TypeError, AttributeError, OverflowError)
+# Superseded log lines tolerated before the log is rewritten on load.
+COMPACT_SLACK = 100
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(repr(value).encode("utf-8")).hexdigest()[:16]
+
+
+def _resolve_like(
+    zones: Dict[str, Dict[str, Any]], zone_id: str, field: str, like: str
+):
+    """Follows "<field>LikeZone" links, guarding against cycles."""
+    seen = set()
+    zone = zones[zone_id]
+    while field not in zone and like in zone and zone[like] not in seen:
+        seen.add(zone[like])
+        zone = zones.get(str(zone[like]), {})
+    return zone.get(field)
+
+
+def _zone_label(zones: Dict[str, Dict[str, Any]], zone_id: str) -> str:
+    zone = zones[zone_id]
+    mines = _resolve_like(zones, zone_id, "mines", "minesLikeZone") or {}
+    treasure = _resolve_like(zones, zone_id, "treasure", "treasureLikeZone") or []
+    return _digest(
+        (
+            zone.get("type"),
+            zone.get("size"),
+            # Owners are player slots, which are as interchangeable as zone ids.
+            zone.get("owner") is not None,
+            tuple(sorted((k, v) for k, v in mines.items() if v)),
+            tuple(
+                sorted(
+                    (
+                        t["min"] // VALUE_BAND,
+                        t["max"] // VALUE_BAND,
+                        t["density"] // DENSITY_BAND,
+                    )
+                    for t in treasure
+                )
+            ),
+        )
+    )
+
+
+def fingerprint_dict(raw: Dict[str, Any]) -> str:
+    """
+    Weisfeiler-Lehman hash of the zone graph of a template dict (VCMI or cache format).
+    Names, descriptions and zone numbering do not affect it.
+    """
+    zones = {str(zone_id): zone for zone_id, zone in raw["zones"].items()}
+    # Dangling connections are reported by find_problems, they carry no structure.
+    connections = [
+        connection
+        for connection in raw.get("connections", [])
+        if str(connection["a"]) in zones and str(connection["b"]) in zones
+    ]
+    graph = ZoneGraph.from_dict(zones, connections)
+    neighbours: List[List[Tuple[str, int]]] = [[] for _ in range(graph.zone_count)]
+    for i, connection in enumerate(connections):
+        edge = _digest(
+            (
+                connection.get("type", "guarded"),
+                (connection.get("guard") or 0) // VALUE_BAND,
+            )
+        )
+        a, b = graph.conn_a[i], graph.conn_b[i]
+        neighbours[a].append((edge, b))
+        neighbours[b].append((edge, a))
+
+    labels = [_zone_label(zones, str(zone_id)) for zone_id in graph.zone_ids]
+    history = Counter(labels)
+    for _ in range(WL_ITERATIONS):
+        labels = [
+            _digest(
+                (labels[i], tuple(sorted((e, labels[j]) for e, j in neighbours[i])))
+            )
+            for i in range(graph.zone_count)
+        ]
+        history.update(labels)
+    return _digest(
+        (
+            raw.get("minSize"),
+            raw.get("maxSize"),
+            str(raw.get("players")),
+            str(raw.get("humans")),
+            tuple(sorted(history.items())),
+        )
+    )
+
+
+def fingerprint(template: MapTemplate) -> Optional[str]:
+    """Best effort, a template the zone graph cannot hold is logged and skipped."""
+    try:
+        return fingerprint_dict(
+            template.model_dump(by_alias=True, exclude_none=True, mode="json")
+        )
+    except FINGERPRINT_ERRORS as e:
+        logger.warning(f"Not fingerprinting {template.id}: {e!r}")
+        return None
+
+
+class FingerprintIndex:
+    """
+    Fingerprints of the templates in a mod's content/ directory, tracked per file
+    together with its mtime. Changes are appended to a hidden log next to mod.json.
+    Files added, edited or removed behind our back (manual edits, pack) are re-read
+    when content/ changes and before a match is trusted, so stale entries drop out.
+    Keep one instance per process, loading it stats every content file.
+    """
+
+    def __init__(self, save_path: str) -> None:
+        self.path = os.path.join(save_path, INDEX_FILE)
+        self.content_dir = os.path.join(save_path, "content")
+        # file -> (mtime_ns, {template id: fingerprint})
+        self.files: Dict[str, Tuple[int, Dict[str, str]]] = {}
+        # fingerprint -> {template id: file}
+        self.by_fingerprint: Dict[str, Dict[str, str]] = {}
+        self.content_mtime: Optional[int] = None
+        self.load()
+        self.sync()
+
+    def load(self):
+        records = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A write cut short, sync() re-reads whatever it described.
+                        break
+                    records += 1
+                    templates = record.get("templates")
+                    self._set(
+                        record["file"],
+                        None if templates is None else (record["mtime_ns"], templates),
+                    )
+        except FileNotFoundError:
+            pass
+        if records > 2 * len(self.files) + COMPACT_SLACK:
+            self.compact()
+
+    def compact(self):
+        write_file_atomic(
+            self.path,
+            "".join(
+                self._line(file, entry) for file, entry in sorted(self.files.items())
+            ),
+        )
+
+    def sync(self):
+        """Re-reads the files added, changed or removed since content/ last changed."""
+        mtime = self._mtime(self.content_dir)
+        if mtime == self.content_mtime:
+            return
+        self.content_mtime = mtime
+        present = set()
+        if mtime is not None:
+            present = {
+                file
+                for file in os.listdir(self.content_dir)
+                if file.lower().endswith(TEMPLATE_FILE_EXTENSION)
+                and not file.startswith(".")
+            }
+        for file in sorted(present | set(self.files)):
+            self.refresh(file)
+
+    def refresh(self, file: str):
+        """Re-reads a content file if its mtime changed, dropping it if it is gone."""
+        path = os.path.join(self.content_dir, file)
+        mtime = self._mtime(path)
+        entry = self.files.get(file)
+        if mtime is None:
+            if entry is not None:
+                self._record(file, None)
+            return
+        if entry is not None and entry[0] == mtime:
+            return
+        templates: Dict[str, str] = {}
+        try:
+            document = read_template_file(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Not fingerprinting {path}: {e}")
+            document = {}
+        for template_id, raw in iter_raw_templates(document):
+            try:
+                templates[template_id] = fingerprint_dict(raw)
+            except FINGERPRINT_ERRORS as e:
+                logger.warning(f"Not fingerprinting {template_id} from {path}: {e!r}")
+        self._record(file, (mtime, templates))
+
+    def duplicate_of(self, template_id: str, fp: str) -> Optional[str]:
+        """The id of another saved template with the same structure, if any."""
+        self.sync()
+        for other, file in list(self.by_fingerprint.get(fp, {}).items()):
+            if other == template_id:
+                continue
+            # The file may have been edited or deleted without touching content/.
+            self.refresh(file)
+            if self.by_fingerprint.get(fp, {}).get(other) == file:
+                return other
+        return None
+
+    def saved(self, file: str, template_id: str, fp: str):
+        """Records a template we just wrote to content/<file>."""
+        mtime = self._mtime(os.path.join(self.content_dir, file))
+        if mtime is None:
+            return
+        self._record(file, (mtime, {template_id: fp}))
+        # Our own write should not trigger a rescan of content/.
+        self.content_mtime = self._mtime(self.content_dir)
+
+    def _record(self, file: str, entry: Optional[Tuple[int, Dict[str, str]]]):
+        if self.files.get(file) == entry:
+            return
+        self._set(file, entry)
+        ensure_dir_exists(os.path.dirname(self.path))
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(self._line(file, entry))
+
+    def _set(self, file: str, entry: Optional[Tuple[int, Dict[str, str]]]):
+        previous = self.files.pop(file, None)
+        if previous is not None:
+            for template_id, fp in previous[1].items():
+                ids = self.by_fingerprint.get(fp, {})
+                if ids.get(template_id) == file:
+                    del ids[template_id]
+                if not ids:
+                    self.by_fingerprint.pop(fp, None)
+        if entry is not None:
+            self.files[file] = entry
+            for template_id, fp in entry[1].items():
+                self.by_fingerprint.setdefault(fp, {})[template_id] = file
+
+    @staticmethod
+    def _line(file: str, entry: Optional[Tuple[int, Dict[str, str]]]) -> str:
+        record: Dict[str, Any] = {"file": file}
+        if entry is not None:
+            record["mtime_ns"], record["templates"] = entry
+        return json.dumps(record, sort_keys=True) + "\n"
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
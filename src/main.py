@@ -1,14 +1,43 @@
+import itertools
+import os
+from typing import Optional
 import click
 from app import App
+from cache_bundle import export_cache, import_cache
+from disk_cache import DiskCache
 from logger import setup_logging
+from preview import DEFAULT_ITERATIONS, PreviewFormat, write_preview
+from profiler import StackMode, profiler
+from pack import (
+    ShardStrategy,
+    TemplatePacker,
+    iter_cached_templates,
+    iter_saved_templates,
+)
+from template_loader import iter_templates
+from watch import Watcher
 
 
 @click.group()
 @click.option("--debug", is_flag=True, help="Enable debug logging")
+@click.option(
+    "--profile",
+    help="Directory to write a span trace (trace.json) and collapsed stacks to.",
+    default=None,
+)
+@click.option(
+    "--profile-stacks",
+    type=click.Choice([m.value for m in StackMode]),
+    default=StackMode.NONE.value,
+    help="Also profile the run and write collapsed stacks (stacks.folded) for flamegraphs.",
+)
 @click.pass_context
-def main(ctx, debug: bool):
+def main(ctx, debug: bool, profile: Optional[str], profile_stacks: str):
     setup_logging(debug)
     ctx.ensure_object(dict)
+    if profile is not None:
+        profiler.start(os.path.expandvars(profile), StackMode(profile_stacks))
+        ctx.call_on_close(profiler.stop)
 
 
 @main.command()
@@ -35,5 +64,193 @@ def generate(
     app.generate_map()
 
 
+@main.command()
+@click.option(
+    "--config-path",
+    "config_paths",
+    multiple=True,
+    required=True,
+    help="Configuration to regenerate on changes, can be repeated.",
+)
+@click.option(
+    "--cache",
+    help="Path to save the LLM responses to.",
+    default="$XDG_CACHE_HOME/aiomad/responses",
+)
+@click.option(
+    "--interval", type=float, default=0.5, help="Seconds between change checks."
+)
+@click.option(
+    "--debounce",
+    type=float,
+    default=1.0,
+    help="Seconds without further changes before regenerating.",
+)
+@click.pass_context
+def watch(
+    ctx,
+    config_paths: tuple[str, ...],
+    cache: str,
+    interval: float,
+    debounce: float,
+):
+    """Regenerate templates whenever their configs or prompt templates change."""
+    watcher = Watcher(
+        cache_path=cache,
+        config_paths=config_paths,
+        interval=interval,
+        debounce=debounce,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command()
+@click.argument("paths", nargs=-1, required=True)
+@click.pass_context
+def inspect(ctx, paths: tuple[str, ...]):
+    """Summarize VCMI template files or directories without full validation."""
+    for template in iter_templates(paths):
+        size = template.max_size.value + ("+u" if template.has_underground else "")
+        click.echo(
+            f"{template.id}\t{size}\t{template.min_players}-{template.max_players}"
+            f"\t{template.graph.zone_count} zones\t{template.graph.connection_count} connections"
+        )
+
+
+@main.command()
+@click.option(
+    "--input",
+    "inputs",
+    multiple=True,
+    help="Mod directory (or content directory) with generated templates, can be repeated.",
+)
+@click.option(
+    "--cache",
+    help="Also include every template stored in this LLM response cache.",
+    default=None,
+)
+@click.option(
+    "--output",
+    help="Mod directory to write the packed content files and mod.json to.",
+    required=True,
+)
+@click.option(
+    "--shard-by",
+    type=click.Choice([s.value for s in ShardStrategy]),
+    default=ShardStrategy.SIZE.value,
+    help="Shard by minimal map size class or by a hash of the template id.",
+)
+@click.option(
+    "--shards",
+    type=int,
+    default=4,
+    help="Number of content files when sharding by hash.",
+)
+@click.option("--prefix", default="momd", help="Prefix of the content file names.")
+@click.pass_context
+def pack(
+    ctx,
+    inputs: tuple[str, ...],
+    cache: Optional[str],
+    output: str,
+    shard_by: str,
+    shards: int,
+    prefix: str,
+):
+    """Merge many templates into a few sharded content files."""
+    if not inputs and cache is None:
+        raise click.UsageError("Provide at least one --input or --cache")
+    output = os.path.expandvars(output)
+    real_output = os.path.realpath(output)
+    for path in inputs:
+        real_input = os.path.realpath(os.path.expandvars(path))
+        # Reading any part of the output would pack its stale shards into itself.
+        common = os.path.commonpath([real_input, real_output])
+        if common in (real_input, real_output):
+            raise click.UsageError(
+                f"--output must not overlap with --input {path}, one contains the other"
+            )
+    packer = TemplatePacker(
+        save_path=output,
+        strategy=ShardStrategy(shard_by),
+        shards=shards,
+        prefix=prefix,
+    )
+    disk_cache = DiskCache(cache) if cache is not None else None
+    saved = iter_saved_templates(os.path.expandvars(path) for path in inputs)
+    packer.pack(itertools.chain(saved, iter_cached_templates(disk_cache)))
+
+
+@main.command()
+@click.argument("paths", nargs=-1, required=True)
+@click.option("--output", help="Directory to write the previews to.", required=True)
+@click.option(
+    "--format",
+    "preview_format",
+    type=click.Choice([f.value for f in PreviewFormat]),
+    default=PreviewFormat.SVG.value,
+)
+@click.option(
+    "--iterations",
+    type=int,
+    default=DEFAULT_ITERATIONS,
+    help="Iterations of the force-directed solver.",
+)
+@click.pass_context
+def preview(
+    ctx,
+    paths: tuple[str, ...],
+    output: str,
+    preview_format: str,
+    iterations: int,
+):
+    """Render an approximate zone layout of every template, without VCMI."""
+    output = os.path.expandvars(output)
+    for template in iter_templates(paths):
+        path = write_preview(
+            template, output, PreviewFormat(preview_format), iterations
+        )
+        click.echo(path)
+
+
+@main.group()
+def cache():
+    """Share LLM response caches between machines."""
+
+
+@cache.command("export")
+@click.option(
+    "--cache",
+    "cache_path",
+    help="Path of the LLM response cache to export.",
+    default="$XDG_CACHE_HOME/aiomad/responses",
+)
+@click.option("--output", help="Path of the bundle to write.", required=True)
+def cache_export(cache_path: str, output: str):
+    """Pack all cache entries into a compressed, content-addressed bundle."""
+    export_cache(DiskCache(cache_path), os.path.expandvars(output))
+
+
+@cache.command("import")
+@click.option(
+    "--cache",
+    "cache_path",
+    help="Path of the LLM response cache to merge the bundle into.",
+    default="$XDG_CACHE_HOME/aiomad/responses",
+)
+@click.argument("bundles", nargs=-1, required=True)
+def cache_import(cache_path: str, bundles: tuple[str, ...]):
+    """Merge bundles into the cache, keeping entries that already exist."""
+    disk_cache = DiskCache(cache_path)
+    corrupt = 0
+    for bundle in bundles:
+        corrupt += len(import_cache(disk_cache, os.path.expandvars(bundle)).corrupt)
+    if corrupt:
+        raise click.ClickException(f"{corrupt} entries failed verification")
+
+
 if __name__ == "__main__":
     main()
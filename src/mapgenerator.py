@@ -1,34 +1,73 @@
 import json
+import logging
 import os
-from typing import List
+from typing import List, Optional
 from ai import AI
 
-from config import Config
-from file import write_file
+from config import Config, DuplicatePolicy
+from file import write_file_atomic
+from fingerprint import FingerprintIndex, fingerprint
 from logger import logger
+from profiler import profiler
 from models import MapTemplate, MapTemplatesWrapper, VCMITemplatesMod
+from template_loader import to_vcmi_dict
 
 
 class MapGenerator:
-    def __init__(self, ai: AI, config: Config) -> None:
+    def __init__(
+        self,
+        ai: AI,
+        config: Config,
+        fingerprints: Optional[FingerprintIndex] = None,
+    ) -> None:
         self.ai = ai
         self.config = config
+        self.fingerprints = fingerprints
 
     def generate(self):
         map_template = self.ai.start()
-        map_template_json = map_template.model_dump_json(
-            indent=2, exclude_none=True, by_alias=True
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                map_template.model_dump_json(indent=2, exclude_none=True, by_alias=True)
+            )
         self.maybe_override_template_name(map_template)
-        logger.debug(map_template_json)
-        self.save_template(map_template)
+        fp = None
+        if self.config.duplicates != DuplicatePolicy.ALLOW:
+            with profiler.span("fingerprint"):
+                fp = fingerprint(map_template)
+                if fp is not None and not self.resolve_duplicate(map_template, fp):
+                    return
+        with profiler.span("save", template=map_template.id):
+            file = self.save_template(map_template)
+        if fp is not None:
+            self.fingerprint_index().saved(file, map_template.id, fp)
+
+    def fingerprint_index(self) -> FingerprintIndex:
+        if self.fingerprints is None:
+            self.fingerprints = FingerprintIndex(self.config.save_path)
+        return self.fingerprints
 
     def maybe_override_template_name(self, map_template: MapTemplate):
         if self.config.template_name_override is None:
             return
         map_template.id = self.config.template_name_override
 
-    def save_template(self, map_template: MapTemplate):
+    def resolve_duplicate(self, map_template: MapTemplate, fp: str) -> bool:
+        """Returns whether the template should be saved, possibly under another id."""
+        duplicate = self.fingerprint_index().duplicate_of(map_template.id, fp)
+        if duplicate is None:
+            return True
+        if self.config.duplicates == DuplicatePolicy.REJECT:
+            logger.warning(
+                f"Not saving {map_template.id}, it has the same structure as {duplicate}"
+            )
+            return False
+        logger.info(f"Merging {map_template.id} into {duplicate}, same structure")
+        map_template.id = duplicate
+        return True
+
+    def save_template(self, map_template: MapTemplate) -> str:
+        """Writes the template and mod.json, returns the name of the content file."""
         file = f"{self.config.save_path}/content/{map_template.id}.JSON"
         logger.debug(f"Saving to file {file}")
         wrapper = MapTemplatesWrapper.new(templates=[map_template])
@@ -36,21 +75,29 @@ class MapGenerator:
             exclude_none=True,
             by_alias=True,
         )
-        for _, val in map_template_dict.items():
-            val.pop("kind")
-            val.pop("id")
-            for _, zone in val["zones"].items():
-                zone.pop("id")
+        map_template_dict = {
+            template_id: to_vcmi_dict(val)
+            for template_id, val in map_template_dict.items()
+        }
         map_template_json = json.dumps(map_template_dict)
-        logger.debug(f"Writing {map_template_json} to file.")
-        write_file(file, map_template_json)
-        files = [os.path.basename(file) for file in os.listdir(os.path.dirname(file))]
+        logger.debug(f"Writing {len(map_template_json)} bytes to file.")
+        write_file_atomic(file, map_template_json)
+        files = [
+            os.path.basename(file)
+            for file in os.listdir(os.path.dirname(file))
+            if not file.startswith(".")
+        ]
         self.save_mod(files)
+        return os.path.basename(file)
 
     def save_mod(self, files: List[str]):
-        mod_file = f"{self.config.save_path}/mod.json"
-        write_file(
-            mod_file,
+        save_mod(self.config.save_path, files)
+
+
+def save_mod(save_path: str, files: List[str]):
+    with profiler.span("manifest write", templates=len(files)):
+        write_file_atomic(
+            f"{save_path}/mod.json",
             VCMITemplatesMod.new(files).model_dump_json(
                 indent=2, exclude_none=True, by_alias=True
             ),
@@ -0,0 +1,119 @@
+import json
+import os
+import zlib
+from contextlib import ExitStack
+from enum import Enum
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from disk_cache import DiskCache
+from file import atomic_writer
+from logger import logger
+from mapgenerator import save_mod
+from models import RealMapSize
+from template_loader import (
+    iter_raw_templates,
+    iter_template_documents,
+    to_vcmi_dict,
+)
+
+
+class ShardStrategy(str, Enum):
+    SIZE = "size"
+    HASH = "hash"
+
+
+class TemplatePacker:
+    """
+    Merges templates into a few content files. Templates are streamed one at a
+    time straight into the shard files, so memory does not grow with the pack.
+    """
+
+    def __init__(
+        self,
+        save_path: str,
+        strategy: ShardStrategy = ShardStrategy.SIZE,
+        shards: int = 4,
+        prefix: str = "momd",
+    ) -> None:
+        if shards < 1:
+            raise ValueError("The number of shards must be at least 1")
+        self.save_path = save_path
+        self.strategy = strategy
+        self.shards = shards
+        self.prefix = prefix
+
+    def shard_file(self, template_id: str, template: Dict[str, Any]) -> str:
+        if self.strategy == ShardStrategy.SIZE:
+            key = RealMapSize.from_string(template["minSize"])["size"].value
+        else:
+            key = str(zlib.crc32(template_id.encode("utf-8")) % self.shards)
+        return f"{self.prefix}_{key}.JSON"
+
+    def pack(self, templates: Iterable[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        content_dir = os.path.join(self.save_path, "content")
+        seen: Set[str] = set()
+        writers: Dict[str, IO[str]] = {}
+        with ExitStack() as stack:
+            for template_id, template in templates:
+                if template_id in seen:
+                    logger.warning(f"Skipping duplicate template {template_id}")
+                    continue
+                try:
+                    file = self.shard_file(template_id, template)
+                except (KeyError, ValueError) as e:
+                    logger.warning(f"Skipping template {template_id}: {e}")
+                    continue
+                seen.add(template_id)
+                writer = writers.get(file)
+                if writer is None:
+                    writer = stack.enter_context(
+                        atomic_writer(os.path.join(content_dir, file))
+                    )
+                    writer.write("{")
+                    writers[file] = writer
+                else:
+                    writer.write(",")
+                writer.write(json.dumps(template_id))
+                writer.write(":")
+                writer.write(json.dumps(template))
+            for writer in writers.values():
+                writer.write("}")
+        files = sorted(writers)
+        self.remove_stale_shards(content_dir, files)
+        save_mod(self.save_path, files)
+        logger.info(f"Packed {len(seen)} templates into {len(files)} files")
+        return files
+
+    def remove_stale_shards(self, content_dir: str, files: List[str]):
+        if not os.path.isdir(content_dir):
+            return
+        for file in os.listdir(content_dir):
+            if file.startswith(f"{self.prefix}_") and file not in files:
+                logger.debug(f"Removing stale shard {file}")
+                os.remove(os.path.join(content_dir, file))
+
+
+def iter_saved_templates(
+    save_paths: Iterable[str],
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Templates already in the VCMI format, from mod directories or content files."""
+    for save_path in save_paths:
+        content_dir = os.path.join(save_path, "content")
+        path = content_dir if os.path.isdir(content_dir) else save_path
+        for _, document in iter_template_documents([path]):
+            yield from iter_raw_templates(document)
+
+
+def iter_cached_templates(
+    cache: Optional[DiskCache],
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    if cache is None:
+        return
+    for hash_key, value in cache.entries():
+        try:
+            document = json.loads(value)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping unreadable cache entry {hash_key}")
+            continue
+        for template_id, template in iter_raw_templates(document):
+            yield template_id, to_vcmi_dict(template)
@@ -0,0 +1,313 @@
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Tuple
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from file import atomic_writer
+from models import ConnectionType, ZoneType
+from template_loader import CompactTemplate, ZoneGraph
+
+DEFAULT_ITERATIONS = 300
+PANEL_SIZE = 512
+MARGIN = 24
+
+# Attraction weights per connection type, portals do not need to be adjacent.
+ATTRACTION = {
+    None: 1.0,
+    ConnectionType.WIDE: 1.0,
+    ConnectionType.FICTIVE: 1.0,
+    ConnectionType.FORCE_PORTAL: 0.2,
+    ConnectionType.REPULSIVE: 0.0,
+}
+# Repulsive connections push harder, but only until the zones are this many rest
+# lengths apart, otherwise they fling whole clusters off the canvas.
+REPULSION_BOOST = 4.0
+REPULSION_RANGE = 3.0
+GRAVITY = 0.2
+# After the underground split, zones that were only apart along z are pushed
+# apart within their level until they no longer overlap.
+RELAX_ITERATIONS = 50
+
+# HOMM3 player colors, zone owners index into it.
+PLAYER_COLORS = [
+    (230, 40, 40),
+    (50, 90, 230),
+    (190, 160, 110),
+    (60, 170, 60),
+    (240, 140, 30),
+    (150, 60, 190),
+    (40, 170, 170),
+    (230, 120, 170),
+]
+ZONE_COLORS = {
+    ZoneType.TREASURE: (220, 190, 60),
+    ZoneType.JUNCTION: (150, 150, 150),
+    ZoneType.SEALED: (60, 60, 60),
+}
+UNKNOWN_COLOR = (200, 200, 200)
+CONNECTION_COLORS = {
+    None: (40, 40, 40),
+    ConnectionType.WIDE: (40, 40, 40),
+    ConnectionType.FICTIVE: (60, 170, 60),
+    ConnectionType.REPULSIVE: (220, 50, 50),
+    ConnectionType.FORCE_PORTAL: (150, 60, 190),
+}
+BACKGROUND = (250, 250, 245)
+
+
+class PreviewFormat(str, Enum):
+    SVG = "svg"
+    PNG = "png"
+
+
+@dataclass
+class Layout:
+    positions: np.ndarray  # (zones, 2)
+    radii: np.ndarray  # (zones,)
+    levels: np.ndarray  # (zones,) 0 = surface, 1 = underground
+
+
+def solve_layout(
+    graph: ZoneGraph,
+    underground: bool,
+    iterations: int = DEFAULT_ITERATIONS,
+    seed: int = 0,
+) -> Layout:
+    """
+    Fruchterman-Reingold style layout where every pair of zones is updated at once.
+    Zone areas follow `size`, connections are springs, `repulsive` connections push
+    harder. With an underground a third axis is solved as well, owned zones are
+    pinned to the surface and the zones drifting farthest from it (half of the
+    total area) are placed underground, then each level is relaxed in 2D so that
+    its zones do not overlap.
+    """
+    n = graph.zone_count
+    if n == 0:
+        empty = np.zeros((0,))
+        return Layout(np.zeros((0, 2)), empty, empty.astype(np.uint8))
+    dims = 3 if underground else 2
+    radii = np.sqrt(np.maximum(np.frombuffer(graph.sizes, dtype=np.uint16), 1))
+    rest = radii[:, None] + radii[None, :]
+    owned = np.frombuffer(graph.owners, dtype=np.uint8) > 0
+
+    attract = np.zeros((n, n))
+    repel = np.zeros((n, n))
+    a = np.frombuffer(graph.conn_a, dtype=np.uint16).astype(np.intp)
+    b = np.frombuffer(graph.conn_b, dtype=np.uint16).astype(np.intp)
+    kinds = [graph.connection_type(i) for i in range(graph.connection_count)]
+    weights = np.array([ATTRACTION.get(kind, 1.0) for kind in kinds])
+    repulsive = np.array([kind == ConnectionType.REPULSIVE for kind in kinds])
+    np.add.at(attract, (a, b), weights)
+    np.add.at(attract, (b, a), weights)
+    np.add.at(repel, (a, b), repulsive * REPULSION_BOOST)
+    np.add.at(repel, (b, a), repulsive * REPULSION_BOOST)
+
+    rng = np.random.default_rng(seed)
+    spread = radii.sum()
+    positions = rng.uniform(-spread / 2, spread / 2, (n, dims))
+    if underground:
+        positions[owned, 2] = 0.0
+    for step in range(iterations):
+        temperature = spread * (1.0 - step / iterations) / 4 + 1e-3
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance = np.maximum(np.linalg.norm(delta, axis=-1), 1e-6)
+        boost = 1.0 + repel * (distance < REPULSION_RANGE * rest)
+        force = boost * rest**2 / distance - attract * distance**2 / rest
+        np.fill_diagonal(force, 0.0)
+        displacement = (delta / distance[..., None] * force[..., None]).sum(axis=1)
+        # Weak gravity keeps disconnected components on the canvas.
+        displacement -= positions * GRAVITY
+        length = np.maximum(np.linalg.norm(displacement, axis=-1), 1e-9)
+        positions += (
+            displacement / length[:, None] * np.minimum(length, temperature)[:, None]
+        )
+        if underground:
+            positions[owned, 2] = 0.0
+
+    levels = np.zeros(n, dtype=np.uint8)
+    if underground:
+        depth = np.abs(positions[:, 2])
+        depth[owned] = -1.0
+        area = radii**2
+        order = np.argsort(-depth)
+        below = np.cumsum(area[order]) <= area.sum() / 2
+        levels[order[below & ~owned[order]]] = 1
+    flat = positions[:, :2].copy()
+    if underground:
+        _separate_levels(flat, rest, levels)
+    return Layout(flat, radii, levels)
+
+
+def _separate_levels(positions: np.ndarray, rest: np.ndarray, levels: np.ndarray):
+    """Moves overlapping zones of the same level apart, half the overlap each."""
+    same_level = levels[:, None] == levels[None, :]
+    np.fill_diagonal(same_level, False)
+    for _ in range(RELAX_ITERATIONS):
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance = np.maximum(np.linalg.norm(delta, axis=-1), 1e-6)
+        overlap = np.where(same_level, np.maximum(rest - distance, 0.0), 0.0)
+        if not overlap.any():
+            return
+        positions += (delta / distance[..., None] * overlap[..., None] / 2).sum(axis=1)
+
+
+def zone_color(graph: ZoneGraph, index: int) -> Tuple[int, int, int]:
+    owner = graph.owners[index]
+    if owner > 0:
+        return PLAYER_COLORS[(owner - 1) % len(PLAYER_COLORS)]
+    zone_type = graph.zone_type(index)
+    return ZONE_COLORS.get(zone_type, UNKNOWN_COLOR) if zone_type else UNKNOWN_COLOR
+
+
+def _to_canvas(layout: Layout) -> Tuple[np.ndarray, np.ndarray]:
+    """Scales positions and radii into a PANEL_SIZE square shared by both levels."""
+    if len(layout.radii) == 0:
+        return layout.positions, layout.radii
+    low = (layout.positions - layout.radii[:, None]).min(axis=0)
+    high = (layout.positions + layout.radii[:, None]).max(axis=0)
+    scale = (PANEL_SIZE - 2 * MARGIN) / max((high - low).max(), 1e-9)
+    return (layout.positions - low) * scale + MARGIN, layout.radii * scale
+
+
+def _hex(color: Tuple[int, int, int]) -> str:
+    return "#%02x%02x%02x" % color
+
+
+def render_svg(template: CompactTemplate, layout: Layout) -> str:
+    graph = template.graph
+    positions, radii = _to_canvas(layout)
+    panels = 2 if template.has_underground else 1
+    offsets = layout.levels.astype(float) * PANEL_SIZE
+    parts: List[str] = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{PANEL_SIZE * panels}" '
+        f'height="{PANEL_SIZE}" font-family="sans-serif" font-size="12">',
+        f'<rect width="100%" height="100%" fill="{_hex(BACKGROUND)}"/>',
+        f"<title>{escape(template.id)}</title>",
+    ]
+    for i in range(graph.connection_count):
+        a, b = graph.conn_a[i], graph.conn_b[i]
+        kind = graph.connection_type(i)
+        dash = "" if kind in (None, ConnectionType.WIDE) else ' stroke-dasharray="6 4"'
+        width = 4 if kind == ConnectionType.WIDE else 2
+        if layout.levels[a] != layout.levels[b]:
+            # Passages between levels cross over to the other panel.
+            dash = ' stroke-dasharray="2 3"'
+        parts.append(
+            f'<line x1="{positions[a, 0] + offsets[a]:.1f}" y1="{positions[a, 1]:.1f}" '
+            f'x2="{positions[b, 0] + offsets[b]:.1f}" y2="{positions[b, 1]:.1f}" '
+            f'stroke="{_hex(CONNECTION_COLORS.get(kind, (0, 0, 0)))}" '
+            f'stroke-width="{width}"{dash}/>'
+        )
+    for i in range(graph.zone_count):
+        x, y = positions[i, 0] + offsets[i], positions[i, 1]
+        parts.append(
+            f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{radii[i]:.1f}" '
+            f'fill="{_hex(zone_color(graph, i))}" fill-opacity="0.8" stroke="#222"/>'
+        )
+        parts.append(
+            f'<text x="{x:.1f}" y="{y + 4:.1f}" text-anchor="middle">{escape(str(graph.zone_ids[i]))}</text>'
+        )
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def _draw_line(
+    canvas: np.ndarray,
+    start: np.ndarray,
+    end: np.ndarray,
+    color,
+    width,
+    dashed: bool = False,
+):
+    steps = int(np.linalg.norm(end - start)) + 1
+    points = np.linspace(start, end, steps).round().astype(np.intp)
+    if dashed:
+        # Same pattern as the SVG, 2 pixels on and 3 off.
+        points = points[np.arange(steps) % 5 < 2]
+    half = width // 2
+    for dy in range(-half, half + 1):
+        for dx in range(-half, half + 1):
+            ys = np.clip(points[:, 1] + dy, 0, canvas.shape[0] - 1)
+            xs = np.clip(points[:, 0] + dx, 0, canvas.shape[1] - 1)
+            canvas[ys, xs] = color
+
+
+def _draw_circle(canvas: np.ndarray, center: np.ndarray, radius: float, color):
+    x0, x1 = (
+        int(max(center[0] - radius, 0)),
+        int(min(center[0] + radius + 1, canvas.shape[1])),
+    )
+    y0, y1 = (
+        int(max(center[1] - radius, 0)),
+        int(min(center[1] + radius + 1, canvas.shape[0])),
+    )
+    ys, xs = np.ogrid[y0:y1, x0:x1]
+    distance = np.sqrt((xs - center[0]) ** 2 + (ys - center[1]) ** 2)
+    region = canvas[y0:y1, x0:x1]
+    region[distance <= radius] = color
+    region[(distance <= radius) & (distance > radius - 1.5)] = (34, 34, 34)
+
+
+def render_png(template: CompactTemplate, layout: Layout) -> bytes:
+    graph = template.graph
+    positions, radii = _to_canvas(layout)
+    panels = 2 if template.has_underground else 1
+    canvas = np.empty((PANEL_SIZE, PANEL_SIZE * panels, 3), dtype=np.uint8)
+    canvas[:] = BACKGROUND
+    shifted = positions.copy()
+    shifted[:, 0] += layout.levels.astype(float) * PANEL_SIZE
+    for i in range(graph.connection_count):
+        a, b = graph.conn_a[i], graph.conn_b[i]
+        kind = graph.connection_type(i)
+        _draw_line(
+            canvas,
+            shifted[a],
+            shifted[b],
+            CONNECTION_COLORS.get(kind, (0, 0, 0)),
+            3 if kind == ConnectionType.WIDE else 1,
+            # Passages between levels cross over to the other panel.
+            dashed=layout.levels[a] != layout.levels[b],
+        )
+    for i in np.argsort(-radii):
+        _draw_circle(canvas, shifted[i], float(radii[i]), zone_color(graph, i))
+    return encode_png(canvas)
+
+
+def encode_png(canvas: np.ndarray) -> bytes:
+    height, width, _ = canvas.shape
+    # Every scanline starts with filter type 0 (none).
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = canvas.reshape(height, width * 3)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def write_preview(
+    template: CompactTemplate,
+    output_dir: str,
+    preview_format: PreviewFormat = PreviewFormat.SVG,
+    iterations: int = DEFAULT_ITERATIONS,
+) -> str:
+    layout = solve_layout(template.graph, template.has_underground, iterations)
+    path = os.path.join(output_dir, f"{template.id}.{preview_format.value}")
+    if preview_format == PreviewFormat.SVG:
+        with atomic_writer(path) as f:
+            f.write(render_svg(template, layout))
+    else:
+        with atomic_writer(path, binary=True) as f:
+            f.write(render_png(template, layout))
+    return path
@@ -0,0 +1,156 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from enum import Enum
+from types import FrameType
+from typing import Any, Dict, Iterator, List, Optional
+
+from file import write_file_atomic
+from logger import logger
+
+TRACE_FILE = "trace.json"
+STACKS_FILE = "stacks.folded"
+SAMPLE_INTERVAL_SECONDS = 0.002
+
+
+class StackMode(str, Enum):
+    NONE = "none"
+    # Periodically snapshots the main thread stack, counts are samples.
+    SAMPLE = "sample"
+    # Hooks every call via sys.setprofile, counts are microseconds of self time.
+    DETERMINISTIC = "deterministic"
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """
+    Records timed spans as a Chrome trace (open in Perfetto or chrome://tracing)
+    and optionally collapsed stacks for flamegraph tools.
+    Spans are no-ops until `start` is called.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.output_dir = ""
+        self.stack_mode = StackMode.NONE
+        self.events: List[Dict[str, Any]] = []
+        self.stacks: Counter[str] = Counter()
+        self._origin = 0
+        self._call_stack: List[List[Any]] = []
+        self._sampler: Optional[threading.Thread] = None
+        self._sampling = threading.Event()
+
+    def start(self, output_dir: str, stack_mode: StackMode = StackMode.NONE):
+        self.enabled = True
+        self.output_dir = output_dir
+        self.stack_mode = stack_mode
+        self._origin = time.perf_counter_ns()
+        if stack_mode == StackMode.SAMPLE:
+            self._sampling.set()
+            self._sampler = threading.Thread(
+                target=self._sample, args=(threading.get_ident(),), daemon=True
+            )
+            self._sampler.start()
+        elif stack_mode == StackMode.DETERMINISTIC:
+            # The frames already running never get a "call" event, seed them so
+            # the stacks are rooted like the sampled ones.
+            now = time.perf_counter_ns()
+            frame: Optional[FrameType] = sys._getframe()
+            while frame is not None:
+                self._call_stack.insert(0, [_frame_name(frame), now, 0])
+                frame = frame.f_back
+            sys.setprofile(self._on_call)
+
+    def stop(self):
+        if not self.enabled:
+            return
+        if self.stack_mode == StackMode.DETERMINISTIC:
+            sys.setprofile(None)
+        elif self._sampler is not None:
+            self._sampling.clear()
+            self._sampler.join()
+        self.enabled = False
+        self.write()
+
+    @contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self._origin) / 1000,
+                    "dur": (end - start) / 1000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def write(self):
+        trace_file = os.path.join(self.output_dir, TRACE_FILE)
+        write_file_atomic(
+            trace_file,
+            json.dumps({"traceEvents": self.events, "displayTimeUnit": "ms"}),
+        )
+        logger.info(f"Wrote {len(self.events)} spans to {trace_file}")
+        for event in self.events:
+            logger.info(f"{event['name']}: {event['dur'] / 1000:.1f}ms")
+        if self.stack_mode == StackMode.NONE:
+            return
+        stacks_file = os.path.join(self.output_dir, STACKS_FILE)
+        write_file_atomic(
+            stacks_file,
+            "".join(f"{stack} {count}\n" for stack, count in self.stacks.items()),
+        )
+        logger.info(f"Wrote collapsed stacks to {stacks_file}")
+
+    def _sample(self, thread_id: int):
+        while self._sampling.is_set():
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+            time.sleep(SAMPLE_INTERVAL_SECONDS)
+
+    def _on_call(self, frame: FrameType, event: str, arg: Any):
+        now = time.perf_counter_ns()
+        if event == "call":
+            self._call_stack.append([_frame_name(frame), now, 0])
+        elif event == "c_call":
+            name = f"{getattr(arg, '__module__', None) or 'builtins'}:{getattr(arg, '__qualname__', repr(arg))}"
+            self._call_stack.append([name, now, 0])
+        elif self._call_stack:
+            # "return", "c_return" and "c_exception" close the innermost call.
+            name, start, children = self._call_stack.pop()
+            total = now - start
+            stack = ";".join(entry[0] for entry in self._call_stack)
+            key = f"{stack};{name}" if stack else name
+            self.stacks[key] += max(total - children, 0) // 1000
+            if self._call_stack:
+                self._call_stack[-1][2] += total
+
+
+profiler = Profiler()
@@ -0,0 +1,129 @@
+import json
+import os
+import re
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, List, Optional
+
+from config import Config
+from file import ensure_dir_exists
+from logger import logger
+from models import MapSize, MapTemplate, ZoneType
+
+# Edge length in tiles of a single level.
+MAP_EDGE = {
+    MapSize.SMALL: 36,
+    MapSize.MEDIUM: 72,
+    MapSize.LARGE: 108,
+    MapSize.EXTRA_LARGE: 144,
+    MapSize.HUGE: 180,
+    MapSize.EXTRA_HUGE: 216,
+    MapSize.GIGANTIC: 252,
+}
+# Rough fit of the templates in dist/: about one zone per 600 tiles, and each
+# zone costs ~400 output tokens on top of the template header.
+TILES_PER_ZONE = 600
+MIN_ZONES_PER_PLAYER = 2
+TOKENS_PER_ZONE = 400
+BASE_OUTPUT_TOKENS = 500
+TOKENS_PER_FREEFORM_LINE = 150
+
+_NO_UNDERGROUND_RE = re.compile(r"\bno\s+underground\b", re.IGNORECASE)
+_UNDERGROUND_RE = re.compile(r"\bunderground\b", re.IGNORECASE)
+
+
+@dataclass
+class RouteEstimate:
+    underground: bool
+    zones: int
+    output_tokens: int
+
+
+def estimate(config: Config) -> RouteEstimate:
+    freeform = config.freeform or ""
+    # Freeform is the only place the underground is requested.
+    underground = bool(_UNDERGROUND_RE.search(freeform)) and not bool(
+        _NO_UNDERGROUND_RE.search(freeform)
+    )
+    tiles = MAP_EDGE[config.map_size] ** 2 * (2 if underground else 1)
+    zones = max(config.players * MIN_ZONES_PER_PLAYER, tiles // TILES_PER_ZONE)
+    freeform_lines = len([line for line in freeform.splitlines() if line.strip()])
+    output_tokens = (
+        BASE_OUTPUT_TOKENS
+        + zones * TOKENS_PER_ZONE
+        + freeform_lines * TOKENS_PER_FREEFORM_LINE
+    )
+    return RouteEstimate(
+        underground=underground, zones=zones, output_tokens=output_tokens
+    )
+
+
+def find_problems(template: MapTemplate, config: Config) -> List[str]:
+    """Cheap structural checks that pydantic cannot express."""
+    problems = []
+    zone_ids = set(template.zones.keys())
+    for connection in template.connections:
+        for end in (connection.a, connection.b):
+            if end not in zone_ids:
+                problems.append(f"connection references unknown zone {end}")
+    starts = [
+        zone
+        for zone in template.zones.values()
+        if zone.zone_type in (ZoneType.PLAYER_START, ZoneType.CPU_START)
+    ]
+    if len(starts) < config.players:
+        problems.append(f"{len(starts)} starting zones for {config.players} players")
+    return problems
+
+
+class Router:
+    """
+    Picks the models to try for a config, fast first when the map looks small,
+    and appends every attempt to the routing log for tuning the thresholds.
+    """
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.routing = config.llm_routing
+        self.estimate = estimate(config)
+
+    def models(self) -> List[str]:
+        if self.routing is None:
+            return [self.config.llm_model]
+        strong = self.routing.strong_model or self.config.llm_model
+        if (
+            self.estimate.zones > self.routing.max_fast_zones
+            or self.estimate.output_tokens > self.routing.max_fast_output_tokens
+            or self.routing.fast_model == strong
+        ):
+            return [strong]
+        return [self.routing.fast_model, strong]
+
+    def record(
+        self,
+        model: str,
+        attempt: int,
+        started: float,
+        problems: List[str],
+        usage: Optional[Any] = None,
+    ):
+        if self.routing is None:
+            return
+        entry = {
+            "time": time.time(),
+            "map_size": self.config.map_size.value,
+            "players": self.config.players,
+            "humans": self.config.human,
+            "freeform_chars": len(self.config.freeform or ""),
+            "estimate": asdict(self.estimate),
+            "model": model,
+            "attempt": attempt,
+            "latency_s": round(time.perf_counter() - started, 3),
+            "ok": not problems,
+            "problems": problems,
+            "output_tokens": getattr(usage, "output_tokens", None),
+        }
+        logger.debug(f"Routing decision: {entry}")
+        ensure_dir_exists(os.path.dirname(self.routing.log_path))
+        with open(self.routing.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
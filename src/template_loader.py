@@ -0,0 +1,295 @@
+import json
+import os
+import re
+from array import array
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from logger import logger
+from models import (
+    ConnectionType,
+    MapSize,
+    MapTemplate,
+    PlayerCount,
+    RealMapSize,
+    ZoneType,
+)
+
+TEMPLATE_FILE_EXTENSION = ".json"
+UNKNOWN_CODE = 255
+ZONE_TYPES: Tuple[ZoneType, ...] = tuple(ZoneType)
+ZONE_TYPE_CODES: Dict[str, int] = {t.value: i for i, t in enumerate(ZONE_TYPES)}
+# Code 0 is the VCMI default ("guarded"), which the models represent as a missing type.
+CONNECTION_TYPES: Tuple[Optional[ConnectionType], ...] = (None,) + tuple(ConnectionType)
+CONNECTION_TYPE_CODES: Dict[str, int] = {
+    t.value: i for i, t in enumerate(CONNECTION_TYPES) if t is not None
+}
+CONNECTION_TYPE_CODES["guarded"] = 0
+
+_COMMENT_RE = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+
+
+class ZoneGraph:
+    """
+    Array-backed zone and connection graph of a single template.
+    Zones are addressed by their index, connections reference zone indices.
+    """
+
+    __slots__ = (
+        "zone_ids",
+        "zone_types",
+        "sizes",
+        "owners",
+        "conn_a",
+        "conn_b",
+        "conn_types",
+        "conn_guards",
+    )
+
+    def __init__(self) -> None:
+        self.zone_ids = array("I")
+        self.zone_types = array("B")
+        self.sizes = array("H")
+        # 0 means the zone has no owner.
+        self.owners = array("B")
+        self.conn_a = array("H")
+        self.conn_b = array("H")
+        self.conn_types = array("B")
+        self.conn_guards = array("I")
+
+    @property
+    def zone_count(self) -> int:
+        return len(self.zone_ids)
+
+    @property
+    def connection_count(self) -> int:
+        return len(self.conn_a)
+
+    def zone_type(self, index: int) -> Optional[ZoneType]:
+        code = self.zone_types[index]
+        return None if code == UNKNOWN_CODE else ZONE_TYPES[code]
+
+    def connection_type(self, index: int) -> Optional[ConnectionType]:
+        code = self.conn_types[index]
+        return None if code == UNKNOWN_CODE else CONNECTION_TYPES[code]
+
+    @staticmethod
+    def from_dict(
+        zones: Dict[str, Dict[str, Any]], connections: List[Dict[str, Any]]
+    ) -> "ZoneGraph":
+        graph = ZoneGraph()
+        index_of: Dict[str, int] = {}
+        for zone_id, zone in zones.items():
+            index_of[str(zone_id)] = len(graph.zone_ids)
+            graph.zone_ids.append(int(zone_id))
+            graph.zone_types.append(
+                ZONE_TYPE_CODES.get(zone.get("type", ""), UNKNOWN_CODE)
+            )
+            graph.sizes.append(int(zone.get("size", 1)))
+            graph.owners.append(int(zone.get("owner") or 0))
+        for connection in connections:
+            a, b = str(connection["a"]), str(connection["b"])
+            if a not in index_of or b not in index_of:
+                raise ValueError(f"Connection {a}-{b} references an unknown zone")
+            graph.conn_a.append(index_of[a])
+            graph.conn_b.append(index_of[b])
+            graph.conn_types.append(
+                CONNECTION_TYPE_CODES.get(
+                    connection.get("type", "guarded"), UNKNOWN_CODE
+                )
+            )
+            graph.conn_guards.append(int(connection.get("guard") or 0))
+        return graph
+
+
+class CompactTemplate:
+    """
+    Lightweight view of a VCMI template for bulk analysis. Only the graph is kept
+    in memory, the full template is re-read from its file on `to_dict` and only
+    validated on `to_map_template`.
+    """
+
+    __slots__ = (
+        "id",
+        "name",
+        "min_size",
+        "min_underground",
+        "max_size",
+        "max_underground",
+        "min_players",
+        "max_players",
+        "min_humans",
+        "max_humans",
+        "graph",
+        "source_path",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        min_size: MapSize,
+        min_underground: bool,
+        max_size: MapSize,
+        max_underground: bool,
+        players: Tuple[int, int],
+        humans: Tuple[int, int],
+        graph: ZoneGraph,
+        source_path: str,
+    ) -> None:
+        self.id = id
+        self.name = name
+        self.min_size = min_size
+        self.min_underground = min_underground
+        self.max_size = max_size
+        self.max_underground = max_underground
+        self.min_players, self.max_players = players
+        self.min_humans, self.max_humans = humans
+        self.graph = graph
+        self.source_path = source_path
+
+    @property
+    def has_underground(self) -> bool:
+        return self.min_underground or self.max_underground
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The template in the MapTemplate (cache) format, including ids."""
+        mtime = os.stat(self.source_path).st_mtime_ns
+        raw = _templates_in(self.source_path, mtime).get(self.id)
+        if raw is None:
+            raise KeyError(f"Template {self.id} is no longer in {self.source_path}")
+        return to_map_template_dict(self.id, raw)
+
+    def to_map_template(self) -> MapTemplate:
+        return MapTemplate.model_validate(self.to_dict())
+
+    @staticmethod
+    def from_dict(
+        template_id: str, raw: Dict[str, Any], source_path: str
+    ) -> "CompactTemplate":
+        min_size = RealMapSize.from_string(raw["minSize"])
+        max_size = RealMapSize.from_string(raw["maxSize"])
+        zones = raw.get("zones", {})
+        connections = raw.get("connections", [])
+        return CompactTemplate(
+            id=template_id,
+            name=raw.get("name", template_id),
+            min_size=min_size["size"],
+            min_underground=min_size["has_underground"],
+            max_size=max_size["size"],
+            max_underground=max_size["has_underground"],
+            players=_player_range(raw.get("players", "0")),
+            humans=_player_range(raw.get("humans", "0")),
+            graph=ZoneGraph.from_dict(zones, connections),
+            source_path=source_path,
+        )
+
+
+def _player_range(value: Any) -> Tuple[int, int]:
+    count = PlayerCount.from_string(str(value))
+    min_players = count["min_players"]
+    return min_players, count.get("max_players", min_players)
+
+
+def to_map_template_dict(template_id: str, raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Adds the ids a VCMI template lacks to match the MapTemplate (cache) format."""
+    return {
+        **raw,
+        "kind": "map_template",
+        "id": template_id,
+        "zones": {
+            zone_id: {**zone, "id": int(zone_id)}
+            for zone_id, zone in raw.get("zones", {}).items()
+        },
+    }
+
+
+def to_vcmi_dict(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Strips the fields VCMI does not know about from a MapTemplate dump."""
+    template = {k: v for k, v in raw.items() if k not in ("kind", "id")}
+    template["zones"] = {
+        zone_id: {k: v for k, v in zone.items() if k != "id"}
+        for zone_id, zone in raw["zones"].items()
+    }
+    return template
+
+
+def read_template_file(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        # Stock VCMI templates are allowed to contain comments and trailing commas.
+        stripped = _COMMENT_RE.sub(lambda m: m.group(1) or "", content)
+        return json.loads(_TRAILING_COMMA_RE.sub(r"\1", stripped))
+
+
+@lru_cache(maxsize=4)
+def _templates_in(path: str, mtime_ns: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Raw templates of a file by id, so converting every template of a shard parses
+    it once. The mtime is only part of the cache key. Do not mutate the result.
+    """
+    return dict(iter_raw_templates(read_template_file(path)))
+
+
+def iter_raw_templates(
+    document: Any,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Yields (id, template) pairs from either a VCMI content file ({id: template})
+    or a single MapTemplate dump as stored in the cache.
+    """
+    if not isinstance(document, dict):
+        return
+    if document.get("kind") == "map_template":
+        yield document["id"], document
+        return
+    for template_id, raw in document.items():
+        if isinstance(raw, dict) and "zones" in raw:
+            yield template_id, raw
+
+
+def iter_template_files(paths: Iterable[str]) -> Iterator[str]:
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for file in sorted(files):
+                if file.lower().endswith(TEMPLATE_FILE_EXTENSION):
+                    yield os.path.join(root, file)
+
+
+def iter_template_documents(
+    paths: Iterable[str],
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yields (file, document) pairs, skipping files that are not template JSON."""
+    for file in iter_template_files(paths):
+        try:
+            document = read_template_file(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable template file {file}: {e}")
+            continue
+        if not isinstance(document, dict):
+            logger.warning(f"Skipping {file}, it does not hold a JSON object")
+            continue
+        yield file, document
+
+
+def iter_templates(paths: Iterable[str]) -> Iterator[CompactTemplate]:
+    """Streams templates file by file, skipping files and templates that fail to parse."""
+    for file, document in iter_template_documents(paths):
+        for template_id, raw in iter_raw_templates(document):
+            try:
+                yield CompactTemplate.from_dict(template_id, raw, file)
+            except (
+                KeyError,
+                ValueError,
+                TypeError,
+                AttributeError,
+                OverflowError,
+            ) as e:
+                logger.warning(f"Skipping template {template_id} from {file}: {e}")
@@ -1,24 +1,36 @@
 import pathlib
-from jinja2 import Environment, FileSystemLoader, Template
+from typing import Optional
+from jinja2 import Environment, FileSystemLoader
 
 from config import Config
+from profiler import profiler
+
+
+TEMPLATES_DIR = pathlib.Path(__file__).parent.resolve() / "templates"
+INITIAL_PROMPT = "initial_prompt.j2"
+
+
+def new_environment() -> Environment:
+    # auto_reload (the default) re-reads templates whose files changed on disk.
+    return Environment(loader=FileSystemLoader(TEMPLATES_DIR), auto_reload=True)
 
 
 class Templates:
-    def __init__(self, config: Config) -> None:
-        parent = pathlib.Path(__file__).parent.resolve()
-        self.env = Environment(loader=FileSystemLoader(parent / "templates"))
-        self.template = self.env.get_template("initial_prompt.j2")
+    def __init__(self, config: Config, env: Optional[Environment] = None) -> None:
+        self.env = env if env is not None else new_environment()
         self.config = config
         if self.config.prompt_template_overwrite is not None:
-            self.template = Template(self.config.prompt_template_overwrite)
+            self.template = self.env.from_string(self.config.prompt_template_overwrite)
+        else:
+            self.template = self.env.get_template(INITIAL_PROMPT)
 
     def get_initial_prompt(self):
-        output = self.template.render(
-            seed=self.config.llm_seed,
-            map_size=self.config.map_size,
-            players=self.config.players,
-            humans=self.config.human,
-            freeform=self.config.freeform,
-        )
+        with profiler.span("prompt render"):
+            output = self.template.render(
+                seed=self.config.llm_seed,
+                map_size=self.config.map_size,
+                players=self.config.players,
+                humans=self.config.human,
+                freeform=self.config.freeform,
+            )
         return output
@@ -0,0 +1,115 @@
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+from ai import AI, AgentPool
+from config import Config, DuplicatePolicy, load
+from disk_cache import DiskCache
+from fingerprint import FingerprintIndex
+from logger import logger
+from mapgenerator import MapGenerator
+from profiler import profiler
+from templates import TEMPLATES_DIR, Templates, new_environment
+
+
+class Watcher:
+    """
+    Regenerates templates whenever their config or a prompt template changes.
+    The cache, the Jinja environment, the agents and the fingerprint indexes are
+    kept warm between runs.
+    """
+
+    def __init__(
+        self,
+        cache_path: str,
+        config_paths: Iterable[str],
+        interval: float = 0.5,
+        debounce: float = 1.0,
+    ) -> None:
+        self.cache = DiskCache(cache_path)
+        self.env = new_environment()
+        self.agents: AgentPool = {}
+        self.fingerprints: Dict[str, FingerprintIndex] = {}
+        self.config_paths = [os.path.abspath(path) for path in config_paths]
+        self.configs: Dict[str, Config] = {}
+        self.interval = interval
+        self.debounce = debounce
+
+    def watched_files(self) -> List[str]:
+        templates = [
+            str(TEMPLATES_DIR / file)
+            for file in sorted(os.listdir(TEMPLATES_DIR))
+            if file.endswith(".j2")
+        ]
+        return self.config_paths + templates
+
+    def snapshot(self) -> Dict[str, Optional[int]]:
+        mtimes: Dict[str, Optional[int]] = {}
+        for path in self.watched_files():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                mtimes[path] = None
+        return mtimes
+
+    def affected_configs(self, changed: Set[str]) -> List[str]:
+        prompt_changed = any(path not in self.config_paths for path in changed)
+        affected = []
+        for path in self.config_paths:
+            config = self.configs.get(path)
+            # A config with its own prompt does not depend on the bundled templates.
+            uses_bundled_prompt = (
+                config is None or config.prompt_template_overwrite is None
+            )
+            if path in changed or (prompt_changed and uses_bundled_prompt):
+                affected.append(path)
+        return affected
+
+    def generate(self, config_path: str):
+        started = time.perf_counter()
+        with profiler.span("config load", path=config_path):
+            config = load(config_path)
+        self.configs[config_path] = config
+        templates = Templates(config, env=self.env)
+        ai = AI(self.cache, templates, config, agents=self.agents)
+        fingerprints = None
+        if config.duplicates != DuplicatePolicy.ALLOW:
+            fingerprints = self.fingerprints.get(config.save_path)
+            if fingerprints is None:
+                fingerprints = FingerprintIndex(config.save_path)
+                self.fingerprints[config.save_path] = fingerprints
+        with profiler.span("generate map", path=config_path):
+            MapGenerator(ai=ai, config=config, fingerprints=fingerprints).generate()
+        logger.info(
+            f"Regenerated {config_path} in {time.perf_counter() - started:.1f}s"
+        )
+
+    def regenerate(self, config_paths: Iterable[str]):
+        for config_path in config_paths:
+            try:
+                self.generate(config_path)
+            except Exception as e:
+                # Keep watching, the next edit will most likely fix it.
+                logger.error(f"Failed to regenerate {config_path}: {e}")
+
+    def run(self):
+        mtimes = self.snapshot()
+        self.regenerate(self.config_paths)
+        logger.info(f"Watching {len(mtimes)} files for changes")
+        pending: Set[str] = set()
+        last_change = 0.0
+        while True:
+            time.sleep(self.interval)
+            current = self.snapshot()
+            changed = {
+                path for path, mtime in current.items() if mtimes.get(path) != mtime
+            }
+            mtimes = current
+            if changed:
+                logger.debug(f"Changed: {changed}")
+                pending |= changed
+                last_change = time.monotonic()
+                continue
+            if pending and time.monotonic() - last_change >= self.debounce:
+                self.regenerate(self.affected_configs(pending))
+                pending.clear()